@@ -0,0 +1,41 @@
+import math
+import os
+
+# ========================================
+# GUNICORN CONFIGURATION
+# ========================================
+# Shared by every service image (loaded from the working directory)
+# Per-service CMD flags in the Dockerfile override these defaults
+# ========================================
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+
+def _cpu_limit():
+    """CPUs allowed by the pod's CPU limit (cgroup v2 CFS quota), or None"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+
+# Worker parallelism: one process per CPU the pod may use, capped at 4; each
+# worker has a thread pool. Kubernetes CPU limits are enforced as a CFS quota
+# (cpu.max), not an affinity mask, so both are checked
+_cpus = len(os.sched_getaffinity(0))
+_limit = _cpu_limit()
+if _limit is not None:
+    _cpus = min(_cpus, _limit)
+workers = int(os.getenv("WEB_CONCURRENCY", min(_cpus, 4)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Worker heartbeat files on tmpfs (disk-backed /tmp can block the heartbeat)
+worker_tmp_dir = "/dev/shm"
+
+# Keep broker connections open between events (ignored by sync workers)
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
@@ -1,8 +1,16 @@
 import os
 import uuid
 import logging
+import hashlib
+import threading
+import collections
 import re
+import string
+import ahocorasick
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 # ========================================
 # CONTENT VALIDATOR SERVICE
@@ -12,14 +20,43 @@ from flask import Flask, request, jsonify
 # Technique: Rule-based validation (NO AI needed)
 # ========================================
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Negotiated gzip for JSON replies (only when the caller sends Accept-Encoding)
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 1
+Compress(app)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
     format='%(asctime)s - [CONTENT_VALIDATOR] - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
+# Replies remembered for redelivered events (per worker process), bounded
+# by total body bytes; larger replies are never cached
+REPLY_CACHE_BYTES = int(os.getenv("REPLY_CACHE_BYTES", str(8 << 20)))
+REPLY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REPLY_CACHE_MAX_ENTRY_BYTES", str(64 << 10)))
+
 # Validation rules
 SPAM_KEYWORDS = [
     'viagra', 'cialis', 'lottery', 'winner', 'congratulations',
@@ -32,6 +69,45 @@ PROFANITY_LIST = [
 ]
 
 
+def _build_automaton(entries):
+    """Build an Aho-Corasick automaton from (keyword, value) pairs"""
+    automaton = ahocorasick.Automaton()
+    for keyword, value in entries:
+        automaton.add_word(keyword, value)
+    automaton.make_automaton()
+    return automaton
+
+
+# Keyword automata - one pass over the text finds every keyword in the set
+_SPAM_AUTOMATON = _build_automaton((word, word) for word in SPAM_KEYWORDS)
+_PROFANITY_AUTOMATON = _build_automaton((word, word) for word in PROFANITY_LIST)
+
+# Stop validating at the first failed check (any failure routes to review anyway)
+VALIDATOR_FAIL_FAST = os.getenv("VALIDATOR_FAIL_FAST", "true").lower() == "true"
+
+# Messages arriving with this many upstream failures only get the mandatory
+# checks (0 disables the skip). Off by default: nothing upstream of the
+# validator in this pipeline marks a message as failed yet
+MAX_ERRORS_BEFORE_SKIP = int(os.getenv("MAX_ERRORS_BEFORE_SKIP", "0"))
+
+# Upstream notes that do not mean the message failed (data-extractor adds
+# this to every message without an email, which still validates normally)
+UPSTREAM_NOTES = frozenset({"No email address found"})
+
+# Message size limits
+MIN_CONTENT_LENGTH = 10
+MAX_CONTENT_LENGTH = 10000
+
+# Precompiled patterns (compiled once at import, not per request)
+# URL body is a single character class ('$-_' already covers A-Z, 0-9,
+# '%' and the punctuation), so matching is linear with no alternation
+_URL_RE = re.compile(r'https?://[!$-_a-z]+')
+_REPEAT_RE = re.compile(r'(.)\1{4,}')  # Same character repeated 5+ times
+
+# Translation table that deletes ASCII uppercase letters (runs entirely in C)
+_UPPER_STRIP = str.maketrans('', '', string.ascii_uppercase)
+
+
 class ContentValidator:
     """
     Validates message content using rule-based checks
@@ -44,122 +120,132 @@ class ContentValidator:
     """
     
     def __init__(self):
-        logging.info("✅ Content Validator initialized")
+        logger.info("✅ Content Validator initialized")
+    
+    def check_spam_keywords(self, text_lower):
+        """Check for spam/scam keywords (expects lowercased text)"""
+        hits = {word for _, word in _SPAM_AUTOMATON.iter(text_lower)}
+        return [word for word in SPAM_KEYWORDS if word in hits]
     
-    def check_spam_keywords(self, text):
-        """Check for spam/scam keywords"""
-        text_lower = text.lower()
-        found = [word for word in SPAM_KEYWORDS if word in text_lower]
-        return found
+    def check_profanity(self, text_lower):
+        """Check for profanity keywords (expects lowercased text)"""
+        hits = {word for _, word in _PROFANITY_AUTOMATON.iter(text_lower)}
+        return [word for word in PROFANITY_LIST if word in hits]
     
-    def check_profanity(self, text):
-        """Check for profanity keywords"""
-        text_lower = text.lower()
-        found = [word for word in PROFANITY_LIST if word in text_lower]
-        return found
+    def measure_text(self, text):
+        """Collect length and uppercase counts once for the size/caps checks"""
+        length = len(text)
+        if text.isascii():
+            # C fast path: only A-Z can be uppercase in ASCII text
+            uppercase = length - len(text.translate(_UPPER_STRIP))
+        else:
+            uppercase = sum(map(str.isupper, text))
+        return {
+            "length": length,
+            "uppercase": uppercase
+        }
     
-    def check_length(self, text):
+    def check_length(self, stats):
         """Validate message length"""
         issues = []
-        if len(text) < 10:
-            issues.append("Message too short (minimum 10 characters)")
-        if len(text) > 10000:
-            issues.append("Message too long (maximum 10,000 characters)")
+        if stats["length"] < MIN_CONTENT_LENGTH:
+            issues.append(f"Message too short (minimum {MIN_CONTENT_LENGTH} characters)")
+        if stats["length"] > MAX_CONTENT_LENGTH:
+            issues.append(f"Message too long (maximum {MAX_CONTENT_LENGTH:,} characters)")
         return issues
     
-    def check_excessive_caps(self, text):
+    def check_excessive_caps(self, stats):
         """Check for excessive capitalization (shouting)"""
-        if len(text) > 20:  # Only check if message is long enough
-            caps_ratio = sum(1 for c in text if c.isupper()) / len(text)
+        if stats["length"] > 20:  # Only check if message is long enough
+            caps_ratio = stats["uppercase"] / stats["length"]
             if caps_ratio > 0.5:
                 return "Excessive capitalization detected (>50%)"
         return None
     
     def check_urls(self, text):
         """Check for suspicious number of URLs"""
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, text)
+        # Bound the scan: anything past the length limit already fails validation
+        urls = _URL_RE.findall(text, 0, MAX_CONTENT_LENGTH)
         if len(urls) > 3:
             return f"Too many URLs detected ({len(urls)})"
         return None
     
     def check_repeated_characters(self, text):
         """Check for excessive character repetition (e.g., 'heeeeelp')"""
-        pattern = r'(.)\1{4,}'  # Same character repeated 5+ times
-        if re.search(pattern, text):
+        if _REPEAT_RE.search(text):
             return "Excessive character repetition detected"
         return None
     
-    def validate(self, message):
+    def run_checks(self, content, mandatory_only=False):
         """
-        Run all validation checks on message
+        Run validation checks cheapest first, yielding the issues each one found
+        
+        Being a generator, later (more expensive) checks only run if the
+        caller keeps iterating - this is what makes fail-fast cheap.
+        With mandatory_only, only the length check runs.
         """
-        content = message.get("content", "")
-        message_id = message.get("message_id", "unknown")
+        stats = self.measure_text(content)
         
-        logging.info(f"[{message_id}] 🛡️  Starting content validation...")
+        # Check length (mandatory)
+        yield self.check_length(stats)
+        if mandatory_only:
+            return
         
-        validation_results = {
-            "is_valid": True,
-            "checks_performed": 0,
-            "issues_found": []
-        }
+        # Check excessive caps
+        caps_issue = self.check_excessive_caps(stats)
+        yield [caps_issue] if caps_issue else []
         
         # Check spam keywords
-        spam = self.check_spam_keywords(content)
-        validation_results["checks_performed"] += 1
-        if spam:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].append(f"Spam keywords: {', '.join(spam)}")
-            logging.warning(f"[{message_id}] ⚠️  Spam keywords detected: {spam}")
+        content_lower = content.lower()
+        spam = self.check_spam_keywords(content_lower)
+        yield [f"Spam keywords: {', '.join(spam)}"] if spam else []
         
         # Check profanity
-        profanity = self.check_profanity(content)
-        validation_results["checks_performed"] += 1
-        if profanity:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].append(f"Profanity: {', '.join(profanity)}")
-            logging.warning(f"[{message_id}] ⚠️  Profanity detected: {profanity}")
-        
-        # Check length
-        length_issues = self.check_length(content)
-        validation_results["checks_performed"] += 1
-        if length_issues:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].extend(length_issues)
-            logging.warning(f"[{message_id}] ⚠️  Length issues: {length_issues}")
-        
-        # Check excessive caps
-        caps_issue = self.check_excessive_caps(content)
-        validation_results["checks_performed"] += 1
-        if caps_issue:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].append(caps_issue)
-            logging.warning(f"[{message_id}] ⚠️  {caps_issue}")
+        profanity = self.check_profanity(content_lower)
+        yield [f"Profanity: {', '.join(profanity)}"] if profanity else []
         
         # Check URLs
         url_issue = self.check_urls(content)
-        validation_results["checks_performed"] += 1
-        if url_issue:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].append(url_issue)
-            logging.warning(f"[{message_id}] ⚠️  {url_issue}")
+        yield [url_issue] if url_issue else []
         
         # Check repeated characters
         repeat_issue = self.check_repeated_characters(content)
-        validation_results["checks_performed"] += 1
-        if repeat_issue:
-            validation_results["is_valid"] = False
-            validation_results["issues_found"].append(repeat_issue)
-            logging.warning(f"[{message_id}] ⚠️  {repeat_issue}")
+        yield [repeat_issue] if repeat_issue else []
+    
+    def validate(self, message, fail_fast=VALIDATOR_FAIL_FAST, mandatory_only=False):
+        """
+        Run validation checks on message
+        
+        With fail_fast, stops at the first check that finds an issue.
+        With mandatory_only, skips everything but the length check.
+        """
+        content = message.get("content", "")
+        message_id = message.get("message_id", "unknown")
+        
+        logger.info("[%s] 🛡️  Starting content validation...", message_id)
+        
+        validation_results = {
+            "is_valid": True,
+            "checks_performed": 0,
+            "issues_found": []
+        }
+        
+        for issues in self.run_checks(content, mandatory_only):
+            validation_results["checks_performed"] += 1
+            if issues:
+                validation_results["is_valid"] = False
+                validation_results["issues_found"].extend(issues)
+                logger.debug("[%s] ⚠️  %s", message_id, "; ".join(issues))
+                if fail_fast:
+                    break
         
         message["validation"] = validation_results
         message["processing_stage"] = "validated"
         
         if validation_results["is_valid"]:
-            logging.info(f"[{message_id}] ✅ All validation checks passed ({validation_results['checks_performed']} checks)")
+            logger.info("[%s] ✅ All validation checks passed (%s checks)", message_id, validation_results['checks_performed'])
         else:
-            logging.warning(f"[{message_id}] ❌ Validation failed: {len(validation_results['issues_found'])} issues")
+            logger.warning("[%s] ❌ Validation failed: %s issues", message_id, len(validation_results['issues_found']))
             # Add to errors list
             for issue in validation_results["issues_found"]:
                 message["errors"].append(f"validation:{issue}")
@@ -167,8 +253,59 @@ class ContentValidator:
         return message
 
 
+class ReplyCache:
+    """
+    Remembers recent replies so broker redeliveries skip reprocessing
+    
+    Keyed by the incoming Ce-Id plus a hash of the body, so a reused id
+    with a different payload is still processed normally. Bounded by the
+    total size of the cached reply bodies; replies over max_entry_bytes
+    are not cached at all.
+    
+    Kept identical in data-extractor, content-validator and
+    database-enricher (each image only ships its own app.py).
+    """
+    
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(ce_id, body):
+        """Cache key for an event, or None when it has no stable id"""
+        if not ce_id:
+            return None
+        return ce_id, hashlib.blake2b(body, digest_size=16).digest()
+    
+    def get(self, key):
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is not None:
+                self._entries.move_to_end(key)
+            return reply
+    
+    def put(self, key, reply):
+        """Cache a (body, headers) reply"""
+        size = len(reply[0])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous[0])
+            self._entries[key] = reply
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
 # Global validator instance
 validator = ContentValidator()
+reply_cache = ReplyCache(REPLY_CACHE_BYTES, REPLY_CACHE_MAX_ENTRY_BYTES)
 
 
 @app.route('/healthz', methods=['GET'])
@@ -191,30 +328,50 @@ def handle_event():
     if not request.is_json:
         return jsonify({"error": "Must be JSON"}), 415
 
+    # Redelivered event: replay the reply we already computed
+    cache_key = ReplyCache.key(request.headers.get('Ce-Id'), request.get_data())
+    cached = reply_cache.get(cache_key) if cache_key else None
+    if cached:
+        body, response_headers = cached
+        return app.response_class(body, mimetype="application/json"), 200, response_headers
+
     try:
         incoming_payload = request.get_json()
         message_id = incoming_payload.get("message_id", "unknown")
         
-        logging.info(f"[{message_id}] 📥 Received event from Broker")
-        original_error_count = len(incoming_payload.get("errors", []))
+        logger.info("[%s] 📥 Received event from Broker", message_id)
+        upstream_errors = incoming_payload.get("errors", [])
+        original_error_count = len(upstream_errors)
 
     except Exception as e:
-        logging.error(f"❌ Failed to parse event: {e}")
+        logger.error("❌ Failed to parse event: %s", e)
         return jsonify({"error": "Invalid payload"}), 400
 
+    # Already failed upstream: it is headed for review, so only run mandatory checks
+    upstream_failures = sum(1 for e in upstream_errors if not (isinstance(e, str) and e in UPSTREAM_NOTES))
+    skip_full_validation = 0 < MAX_ERRORS_BEFORE_SKIP <= upstream_failures
+
     # Validate the message
-    processed = validator.validate(incoming_payload)
+    processed = validator.validate(incoming_payload, mandatory_only=skip_full_validation)
+    if skip_full_validation:
+        # The reply is routed as failed, so the body must not claim it passed
+        processed["validation"]["is_valid"] = False
+        processed["validation"]["skipped"] = True
+        processed["validation"]["skip_reason"] = f"{upstream_failures} upstream failures"
 
     # Determine event type based on validation result
     current_error_count = len(processed.get("errors", []))
     
-    if current_error_count > original_error_count:
+    if skip_full_validation:
+        event_type = "com.learning.message.validation-failed"
+        logger.warning("[%s] 🚨 %s upstream failures, skipped full validation and routing to review queue", message_id, upstream_failures)
+    elif current_error_count > original_error_count:
         # New errors were added during validation
         event_type = "com.learning.message.validation-failed"
-        logging.warning(f"[{message_id}] 🚨 Validation failed, routing to review queue")
+        logger.warning("[%s] 🚨 Validation failed, routing to review queue", message_id)
     else:
         event_type = "com.learning.message.validated"
-        logging.info(f"[{message_id}] ✅ Validation passed, continuing pipeline")
+        logger.info("[%s] ✅ Validation passed, continuing pipeline", message_id)
 
     # Reply with new CloudEvent
     response_headers = {
@@ -225,10 +382,15 @@ def handle_event():
         "Ce-Subject": message_id,
     }
 
-    logging.info(f"[{message_id}] 📤 Replying with event type '{event_type}'")
-    return jsonify(processed), 200, response_headers
+    logger.info("[%s] 📤 Replying with event type '%s'", message_id, event_type)
+    response = jsonify(processed)
+    if cache_key:
+        reply_cache.put(cache_key, (response.get_data(), response_headers))
+    return response, 200, response_headers
 
 
 if __name__ == '__main__':
-    logging.info(f"Service starting on port {APP_PORT}")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True)
+    logger.info("Service starting on port %s", APP_PORT)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -1,8 +1,15 @@
 import os
 import uuid
 import logging
+import hashlib
+import threading
+import collections
 import re
+import ahocorasick
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 # ========================================
 # DATA EXTRACTOR SERVICE
@@ -12,14 +19,86 @@ from flask import Flask, request, jsonify
 # Technique: Regex-based extraction (NO AI/LLM needed)
 # ========================================
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Negotiated gzip for JSON replies (only when the caller sends Accept-Encoding)
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 1
+Compress(app)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
     format='%(asctime)s - [DATA_EXTRACTOR] - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
+# Replies remembered for redelivered events (per worker process), bounded
+# by total body bytes; larger replies are never cached
+REPLY_CACHE_BYTES = int(os.getenv("REPLY_CACHE_BYTES", str(8 << 20)))
+REPLY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REPLY_CACHE_MAX_ENTRY_BYTES", str(64 << 10)))
+
+# Keyword sets (matched as substrings, so 'thank' also covers 'thanks')
+URGENT_KEYWORDS = frozenset({
+    'urgent', 'asap', 'emergency', 'immediately',
+    'critical', 'help', 'please help', 'stuck'
+})
+
+POSITIVE_WORDS = frozenset({'happy', 'great', 'excellent', 'thank', 'pleased', 'love', 'wonderful'})
+NEGATIVE_WORDS = frozenset({'frustrated', 'angry', 'disappointed', 'terrible', 'worst', 'hate', 'awful'})
+
+
+def _build_automaton(entries):
+    """Build an Aho-Corasick automaton from (keyword, value) pairs"""
+    automaton = ahocorasick.Automaton()
+    for keyword, value in entries:
+        automaton.add_word(keyword, value)
+    automaton.make_automaton()
+    return automaton
+
+
+# Keyword automata - one pass over the text finds every keyword in the set
+_URGENT_AUTOMATON = _build_automaton((word, word) for word in URGENT_KEYWORDS)
+_SENTIMENT_AUTOMATON = _build_automaton(
+    [(word, ('positive', word)) for word in POSITIVE_WORDS] +
+    [(word, ('negative', word)) for word in NEGATIVE_WORDS]
+)
+
+# Precompiled extraction patterns (compiled once at import, not per request)
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', re.ASCII)
+
+_NAME_RES = [
+    re.compile(p, re.IGNORECASE) for p in (
+        r'(?:my name is|i am|this is)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
+        r'([A-Z][a-z]+\s+[A-Z][a-z]+)'  # Capitalized full name
+    )
+]
+
+_PHONE_RES = [
+    re.compile(p) for p in (
+        r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',  # 123-456-7890 or 1234567890
+        r'\(\d{3}\)\s*\d{3}[-.]?\d{4}'      # (123) 456-7890
+    )
+]
+
 
 class DataExtractor:
     """
@@ -32,12 +111,14 @@ class DataExtractor:
     """
     
     def __init__(self):
-        logging.info("✅ Data Extractor initialized")
+        logger.info("✅ Data Extractor initialized")
         
     def extract_email(self, text):
         """Extract email address using standard email regex"""
-        pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        match = re.search(pattern, text)
+        # Cheap C-level prefilter: no '@' means no email, skip the regex walk
+        if '@' not in text:
+            return None
+        match = _EMAIL_RE.search(text)
         return match.group(0) if match else None
     
     def extract_name(self, text):
@@ -47,13 +128,8 @@ class DataExtractor:
         - "I am Jane Smith"
         - "This is Mike Johnson"
         """
-        patterns = [
-            r'(?:my name is|i am|this is)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
-            r'([A-Z][a-z]+\s+[A-Z][a-z]+)'  # Capitalized full name
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in _NAME_RES:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip().title()
         
@@ -61,35 +137,23 @@ class DataExtractor:
     
     def extract_phone(self, text):
         """Extract phone number (US format)"""
-        patterns = [
-            r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',  # 123-456-7890 or 1234567890
-            r'\(\d{3}\)\s*\d{3}[-.]?\d{4}'      # (123) 456-7890
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _PHONE_RES:
+            match = pattern.search(text)
             if match:
                 return match.group(0)
         
         return None
     
-    def detect_urgency(self, text):
-        """Detect urgency keywords"""
-        urgent_keywords = [
-            'urgent', 'asap', 'emergency', 'immediately',
-            'critical', 'help', 'please help', 'stuck'
-        ]
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in urgent_keywords)
-    
-    def detect_sentiment(self, text):
-        """Simple keyword-based sentiment detection"""
-        positive_words = ['happy', 'great', 'excellent', 'thank', 'pleased', 'love', 'wonderful']
-        negative_words = ['frustrated', 'angry', 'disappointed', 'terrible', 'worst', 'hate', 'awful']
-        
-        text_lower = text.lower()
-        pos_count = sum(1 for word in positive_words if word in text_lower)
-        neg_count = sum(1 for word in negative_words if word in text_lower)
+    def detect_urgency(self, text_lower):
+        """Detect urgency keywords (expects lowercased text)"""
+        return next(_URGENT_AUTOMATON.iter(text_lower), None) is not None
+    
+    def detect_sentiment(self, text_lower):
+        """Simple keyword-based sentiment detection (expects lowercased text)"""
+        # Count distinct words per category in a single pass
+        hits = {hit for _, hit in _SENTIMENT_AUTOMATON.iter(text_lower)}
+        pos_count = sum(1 for category, _ in hits if category == 'positive')
+        neg_count = len(hits) - pos_count
         
         if neg_count > pos_count:
             return "negative"
@@ -102,22 +166,23 @@ class DataExtractor:
         Main processing logic - extract all available data
         """
         content = message.get("content", "")
+        content_lower = content.lower()
         message_id = message.get("message_id", "unknown")
         
-        logging.info(f"[{message_id}] 🔍 Starting data extraction...")
+        logger.info("[%s] 🔍 Starting data extraction...", message_id)
         
         # Extract structured data
         extracted_data = {
             "email": self.extract_email(content),
             "customer_name": self.extract_name(content),
             "phone": self.extract_phone(content),
-            "sentiment": self.detect_sentiment(content),
-            "is_urgent": self.detect_urgency(content),
+            "sentiment": self.detect_sentiment(content_lower),
+            "is_urgent": self.detect_urgency(content_lower),
             "content_length": len(content),
             "word_count": len(content.split())
         }
         
-        logging.info(f"[{message_id}] 📊 Extracted: {extracted_data}")
+        logger.info("[%s] 📊 Extracted: %s", message_id, extracted_data)
         
         # Add extracted data to message
         message["extracted_data"] = extracted_data
@@ -126,8 +191,59 @@ class DataExtractor:
         return message
 
 
+class ReplyCache:
+    """
+    Remembers recent replies so broker redeliveries skip reprocessing
+    
+    Keyed by the incoming Ce-Id plus a hash of the body, so a reused id
+    with a different payload is still processed normally. Bounded by the
+    total size of the cached reply bodies; replies over max_entry_bytes
+    are not cached at all.
+    
+    Kept identical in data-extractor, content-validator and
+    database-enricher (each image only ships its own app.py).
+    """
+    
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(ce_id, body):
+        """Cache key for an event, or None when it has no stable id"""
+        if not ce_id:
+            return None
+        return ce_id, hashlib.blake2b(body, digest_size=16).digest()
+    
+    def get(self, key):
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is not None:
+                self._entries.move_to_end(key)
+            return reply
+    
+    def put(self, key, reply):
+        """Cache a (body, headers) reply"""
+        size = len(reply[0])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous[0])
+            self._entries[key] = reply
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
 # Global extractor instance
 extractor = DataExtractor()
+reply_cache = ReplyCache(REPLY_CACHE_BYTES, REPLY_CACHE_MAX_ENTRY_BYTES)
 
 
 @app.route('/healthz', methods=['GET'])
@@ -150,14 +266,21 @@ def handle_event():
     if not request.is_json:
         return jsonify({"error": "Must be JSON"}), 415
 
+    # Redelivered event: replay the reply we already computed
+    cache_key = ReplyCache.key(request.headers.get('Ce-Id'), request.get_data())
+    cached = reply_cache.get(cache_key) if cache_key else None
+    if cached:
+        body, response_headers = cached
+        return app.response_class(body, mimetype="application/json"), 200, response_headers
+
     try:
         incoming_payload = request.get_json()
         message_id = incoming_payload.get("message_id", "unknown")
         
-        logging.info(f"[{message_id}] 📥 Received event from Broker")
+        logger.info("[%s] 📥 Received event from Broker", message_id)
 
     except Exception as e:
-        logging.error(f"❌ Failed to parse event: {e}")
+        logger.error("❌ Failed to parse event: %s", e)
         return jsonify({"error": "Invalid payload"}), 400
 
     # Process the message
@@ -168,11 +291,11 @@ def handle_event():
     
     if extracted.get("email"):
         event_type = "com.learning.message.extracted"
-        logging.info(f"[{message_id}] ✅ Data extracted successfully")
+        logger.info("[%s] ✅ Data extracted successfully", message_id)
     else:
         event_type = "com.learning.message.extraction-incomplete"
         processed["errors"].append("No email address found")
-        logging.warning(f"[{message_id}] ⚠️  No email found, marking as incomplete")
+        logger.warning("[%s] ⚠️  No email found, marking as incomplete", message_id)
 
     # Reply with new CloudEvent
     response_headers = {
@@ -183,10 +306,15 @@ def handle_event():
         "Ce-Subject": message_id,
     }
 
-    logging.info(f"[{message_id}] 📤 Replying with event type '{event_type}'")
-    return jsonify(processed), 200, response_headers
+    logger.info("[%s] 📤 Replying with event type '%s'", message_id, event_type)
+    response = jsonify(processed)
+    if cache_key:
+        reply_cache.put(cache_key, (response.get_data(), response_headers))
+    return response, 200, response_headers
 
 
 if __name__ == '__main__':
-    logging.info(f"Service starting on port {APP_PORT}")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True)
+    logger.info("Service starting on port %s", APP_PORT)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1')
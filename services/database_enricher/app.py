@@ -1,9 +1,19 @@
 import os
+import time
 import uuid
+import queue
 import logging
+import hashlib
+import threading
+import collections
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import psycopg2
-from psycopg2 import sql
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 # ========================================
 # DATABASE ENRICHER SERVICE
@@ -13,14 +23,43 @@ from flask import Flask, request, jsonify
 # Integration: PostgreSQL database lookup
 # ========================================
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Negotiated gzip for JSON replies (only when the caller sends Accept-Encoding)
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 1
+Compress(app)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
     format='%(asctime)s - [DATABASE_ENRICHER] - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
+# Replies remembered for redelivered events (per worker process), bounded
+# by total body bytes; larger replies are never cached
+REPLY_CACHE_BYTES = int(os.getenv("REPLY_CACHE_BYTES", str(8 << 20)))
+REPLY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REPLY_CACHE_MAX_ENTRY_BYTES", str(64 << 10)))
+
 # Database configuration
 DB_HOST = os.getenv("DB_HOST", "customer-database")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -28,6 +67,142 @@ DB_NAME = os.getenv("DB_NAME", "customers")
 DB_USER = os.getenv("DB_USER", "demo")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "demo123")
 
+# Connection pool sizing per gunicorn worker: only the single LookupBatcher
+# thread and /healthz ever check out a connection, so one stays open and a
+# couple of spares cover a probe overlapping a batch
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "3"))
+
+# Server-side prepared statement: parsed and planned once per connection
+# Takes an array of emails so one round-trip serves a whole batch
+PREPARE_CUSTOMER_LOOKUP = """
+    PREPARE customer_lookup(text[]) AS
+    SELECT 
+        email,
+        customer_id, 
+        first_name, 
+        last_name, 
+        company_name, 
+        country, 
+        phone,
+        account_status,
+        total_purchases,
+        last_purchase_date
+    FROM customers 
+    WHERE email = ANY($1)
+"""
+EXECUTE_CUSTOMER_LOOKUP = "EXECUTE customer_lookup(%s)"
+
+# Lookup batching: concurrent events share one query per window
+LOOKUP_BATCH_WINDOW_MS = float(os.getenv("LOOKUP_BATCH_WINDOW_MS", "5"))
+LOOKUP_BATCH_SIZE = int(os.getenv("LOOKUP_BATCH_SIZE", "32"))
+LOOKUP_TIMEOUT = float(os.getenv("LOOKUP_TIMEOUT", "5"))
+
+# Customer lookup cache (unknown emails are cached for a shorter time)
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "4096"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "60"))
+CUSTOMER_CACHE_NEGATIVE_TTL = float(os.getenv("CUSTOMER_CACHE_NEGATIVE_TTL", "10"))
+
+
+class CustomerLookupConnection(psycopg2.extensions.connection):
+    """Connection that prepares the customer lookup statement when opened"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self.cursor() as cursor:
+            cursor.execute(PREPARE_CUSTOMER_LOOKUP)
+        self.commit()
+
+
+class CustomerCache:
+    """
+    Thread-safe LRU cache with per-entry expiry
+    
+    Demonstrates:
+    - Memoizing external lookups
+    - TTL-based freshness
+    - Negative caching (misses expire sooner)
+    """
+    
+    def __init__(self, maxsize, ttl, negative_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return (hit, value) - expired entries count as a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries when full"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class LookupBatcher:
+    """
+    Coalesces concurrent lookups into batched queries
+    
+    Demonstrates:
+    - Micro-batching (flush on time window or batch size)
+    - Handing results back to request threads via futures
+    """
+    
+    def __init__(self, lookup_many, window_ms, max_size):
+        self.lookup_many = lookup_many
+        self.window = window_ms / 1000.0
+        self.max_size = max_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="lookup-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, key):
+        """Queue a lookup and return a Future for its result"""
+        future = Future()
+        self._queue.put((key, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+    
+    def _flush(self, batch):
+        keys = list({key for key, _ in batch})
+        try:
+            results = self.lookup_many(keys)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for key, future in batch:
+            future.set_result(results.get(key))
+
 
 class DatabaseEnricher:
     """
@@ -42,69 +217,97 @@ class DatabaseEnricher:
     
     def __init__(self):
         self.conn_string = f"dbname='{DB_NAME}' user='{DB_USER}' password='{DB_PASSWORD}' host='{DB_HOST}' port='{DB_PORT}'"
-        logging.info("✅ Database Enricher initialized")
+        logger.info("✅ Database Enricher initialized")
         
-        # Test connection on startup
+        # Open the connection pool on startup (also tests connectivity)
         try:
-            with psycopg2.connect(self.conn_string) as conn:
-                logging.info(f"✅ Connected to database '{DB_NAME}' at {DB_HOST}:{DB_PORT}")
+            self.pool = ThreadedConnectionPool(
+                minconn=DB_POOL_MIN,
+                maxconn=DB_POOL_MAX,
+                dsn=self.conn_string,
+                connection_factory=CustomerLookupConnection
+            )
+            logger.info("✅ Connected to database '%s' at %s:%s (pool %s-%s)", DB_NAME, DB_HOST, DB_PORT, DB_POOL_MIN, DB_POOL_MAX)
         except psycopg2.OperationalError as e:
-            logging.error(f"❌ Database connection failed: {e}")
+            logger.error("❌ Database connection failed: %s", e)
             raise SystemExit(f"Cannot start without database connection")
+        
+        self.cache = CustomerCache(
+            maxsize=CUSTOMER_CACHE_SIZE,
+            ttl=CUSTOMER_CACHE_TTL,
+            negative_ttl=CUSTOMER_CACHE_NEGATIVE_TTL
+        )
+        self.batcher = LookupBatcher(
+            self._lookup_customers_uncached,
+            window_ms=LOOKUP_BATCH_WINDOW_MS,
+            max_size=LOOKUP_BATCH_SIZE
+        )
     
     def lookup_customer(self, email):
         """
-        Look up customer by email address
+        Look up customer by email address (cached)
         """
-        connection = None
-        cursor = None
+        hit, customer_data = self.cache.get(email)
+        if not hit:
+            future = self.batcher.submit(email)
+            customer_data = future.result(timeout=LOOKUP_TIMEOUT)
+            self.cache.put(email, customer_data)
         
+        # Hand out a copy so callers never mutate the cached entry
+        return dict(customer_data) if customer_data else None
+    
+    def _lookup_customers_uncached(self, emails):
+        """
+        Look up a batch of customers by email address in PostgreSQL
+        
+        Returns a dict keyed by email; unknown emails are absent.
+        After a database restart the pooled connections are stale, so a
+        connection-level failure closes that connection and the batch is
+        retried once on another one.
+        """
         try:
-            connection = psycopg2.connect(self.conn_string)
-            cursor = connection.cursor()
-            
-            query = sql.SQL("""
-                SELECT 
-                    customer_id, 
-                    first_name, 
-                    last_name, 
-                    company_name, 
-                    country, 
-                    phone,
-                    account_status,
-                    total_purchases,
-                    last_purchase_date
-                FROM customers 
-                WHERE email = %s
-            """)
-            
-            cursor.execute(query, (email,))
-            result = cursor.fetchone()
+            return self._query_customers(emails)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.warning("Database connection lost, retrying batch: %s", e)
+            return self._query_customers(emails)
+    
+    def _query_customers(self, emails):
+        """Run the prepared batch lookup on one pooled connection"""
+        connection = self.pool.getconn()
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(EXECUTE_CUSTOMER_LOOKUP, (emails,))
+                rows = cursor.fetchall()
             
-            if result:
-                return {
-                    "customer_id": result[0],
-                    "first_name": result[1],
-                    "last_name": result[2],
-                    "company_name": result[3],
-                    "country": result[4],
-                    "phone": result[5],
-                    "account_status": result[6],
-                    "total_purchases": float(result[7]) if result[7] else 0.0,
-                    "last_purchase_date": result[8].isoformat() if result[8] else None,
+            result = {
+                row[0]: {
+                    "customer_id": row[1],
+                    "first_name": row[2],
+                    "last_name": row[3],
+                    "company_name": row[4],
+                    "country": row[5],
+                    "phone": row[6],
+                    "account_status": row[7],
+                    "total_purchases": float(row[8]) if row[8] else 0.0,
+                    "last_purchase_date": row[9].isoformat() if row[9] else None,
                     "is_known_customer": True
                 }
+                for row in rows
+            }
             
-            return None
-            
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Broken connection: close it rather than hand it back to the pool
+            self.pool.putconn(connection, close=True)
+            raise
         except Exception as e:
-            logging.error(f"Database query error: {e}")
+            logger.error("Database query error: %s", e)
+            # Pool rolls back the open transaction
+            self.pool.putconn(connection)
             raise
-        finally:
-            if cursor:
-                cursor.close()
-            if connection:
-                connection.close()
+        
+        self.pool.putconn(connection)
+        return result
     
     def enrich(self, message):
         """
@@ -114,27 +317,34 @@ class DatabaseEnricher:
         extracted_data = message.get("extracted_data", {})
         email = extracted_data.get("email")
         
-        if not email:
-            logging.warning(f"[{message_id}] ⚠️  No email address to look up")
+        # A non-string email would poison the shared ANY() batch for every
+        # other event in it, so it is treated the same as a missing one
+        if not email or not isinstance(email, str):
+            logger.warning("[%s] ⚠️  No email address to look up", message_id)
             message["errors"].append("enrichment:no-email")
             message["customer_data"] = {"is_known_customer": False}
             return message
         
-        logging.info(f"[{message_id}] 🔍 Looking up customer: {email}")
+        logger.info("[%s] 🔍 Looking up customer: %s", message_id, email)
         
         try:
             customer_data = self.lookup_customer(email)
             
             if customer_data:
-                logging.info(f"[{message_id}] ✅ Customer found: {customer_data.get('first_name')} {customer_data.get('last_name')} (ID: {customer_data.get('customer_id')})")
+                logger.info("[%s] ✅ Customer found: %s %s (ID: %s)", message_id, customer_data.get('first_name'), customer_data.get('last_name'), customer_data.get('customer_id'))
                 message["customer_data"] = customer_data
             else:
-                logging.warning(f"[{message_id}] ⚠️  Customer not found in database")
+                logger.warning("[%s] ⚠️  Customer not found in database", message_id)
                 message["customer_data"] = {"is_known_customer": False}
                 message["errors"].append(f"enrichment:customer-not-found:{email}")
         
+        except FutureTimeoutError:
+            logger.error("[%s] ❌ Database lookup timed out after %ss", message_id, LOOKUP_TIMEOUT)
+            message["errors"].append("enrichment:database-error:lookup-timeout")
+            message["customer_data"] = {"is_known_customer": False}
+        
         except Exception as e:
-            logging.error(f"[{message_id}] ❌ Database lookup failed: {e}")
+            logger.error("[%s] ❌ Database lookup failed: %s", message_id, e)
             message["errors"].append(f"enrichment:database-error:{str(e)}")
             message["customer_data"] = {"is_known_customer": False}
         
@@ -142,20 +352,74 @@ class DatabaseEnricher:
         return message
 
 
+class ReplyCache:
+    """
+    Remembers recent replies so broker redeliveries skip reprocessing
+    
+    Keyed by the incoming Ce-Id plus a hash of the body, so a reused id
+    with a different payload is still processed normally. Bounded by the
+    total size of the cached reply bodies; replies over max_entry_bytes
+    are not cached at all.
+    
+    Kept identical in data-extractor, content-validator and
+    database-enricher (each image only ships its own app.py).
+    """
+    
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(ce_id, body):
+        """Cache key for an event, or None when it has no stable id"""
+        if not ce_id:
+            return None
+        return ce_id, hashlib.blake2b(body, digest_size=16).digest()
+    
+    def get(self, key):
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is not None:
+                self._entries.move_to_end(key)
+            return reply
+    
+    def put(self, key, reply):
+        """Cache a (body, headers) reply"""
+        size = len(reply[0])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous[0])
+            self._entries[key] = reply
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
 # Global enricher instance
 enricher = DatabaseEnricher()
+reply_cache = ReplyCache(REPLY_CACHE_BYTES, REPLY_CACHE_MAX_ENTRY_BYTES)
 
 
 @app.route('/healthz', methods=['GET'])
 def healthz():
     """Kubernetes health check with database connectivity check"""
     try:
-        with psycopg2.connect(enricher.conn_string) as conn:
+        conn = enricher.pool.getconn()
+        try:
             with conn.cursor() as cursor:
                 cursor.execute("SELECT 1")
+        finally:
+            enricher.pool.putconn(conn)
         return "OK", 200
     except Exception as e:
-        logging.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         return "Database connection failed", 503
 
 
@@ -173,15 +437,22 @@ def handle_event():
     if not request.is_json:
         return jsonify({"error": "Must be JSON"}), 415
 
+    # Redelivered event: replay the reply we already computed
+    cache_key = ReplyCache.key(request.headers.get('Ce-Id'), request.get_data())
+    cached = reply_cache.get(cache_key) if cache_key else None
+    if cached:
+        body, response_headers = cached
+        return app.response_class(body, mimetype="application/json"), 200, response_headers
+
     try:
         incoming_payload = request.get_json()
         message_id = incoming_payload.get("message_id", "unknown")
         
-        logging.info(f"[{message_id}] 📥 Received event from Broker")
+        logger.info("[%s] 📥 Received event from Broker", message_id)
         original_error_count = len(incoming_payload.get("errors", []))
 
     except Exception as e:
-        logging.error(f"❌ Failed to parse event: {e}")
+        logger.error("❌ Failed to parse event: %s", e)
         return jsonify({"error": "Invalid payload"}), 400
 
     # Enrich with database data
@@ -194,13 +465,13 @@ def handle_event():
     if current_error_count > original_error_count:
         # Enrichment failed or customer not found
         event_type = "com.learning.message.enrichment-failed"
-        logging.warning(f"[{message_id}] ⚠️  Enrichment incomplete, routing to review")
+        logger.warning("[%s] ⚠️  Enrichment incomplete, routing to review", message_id)
     elif customer_data.get("is_known_customer"):
         event_type = "com.learning.message.enriched"
-        logging.info(f"[{message_id}] ✅ Customer data added, continuing pipeline")
+        logger.info("[%s] ✅ Customer data added, continuing pipeline", message_id)
     else:
         event_type = "com.learning.message.unknown-customer"
-        logging.warning(f"[{message_id}] ⚠️  Unknown customer, routing to review")
+        logger.warning("[%s] ⚠️  Unknown customer, routing to review", message_id)
 
     # Reply with new CloudEvent
     response_headers = {
@@ -211,10 +482,18 @@ def handle_event():
         "Ce-Subject": message_id,
     }
 
-    logging.info(f"[{message_id}] 📤 Replying with event type '{event_type}'")
-    return jsonify(processed), 200, response_headers
+    logger.info("[%s] 📤 Replying with event type '%s'", message_id, event_type)
+    response = jsonify(processed)
+    # Don't remember transient database failures: a redelivery should retry
+    new_errors = processed.get("errors", [])[original_error_count:]
+    transient_failure = any(e.startswith("enrichment:database-error") for e in new_errors)
+    if cache_key and not transient_failure:
+        reply_cache.put(cache_key, (response.get_data(), response_headers))
+    return response, 200, response_headers
 
 
 if __name__ == '__main__':
-    logging.info(f"Service starting on port {APP_PORT}")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True)
+    logger.info("Service starting on port %s", APP_PORT)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1')
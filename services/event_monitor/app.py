@@ -1,9 +1,13 @@
 import os
-import json
+import gzip
+import time
 import logging
-import queue
+import hashlib
+import itertools
+import threading
 import collections
-from flask import Flask, request, jsonify, render_template_string, Response
+import orjson
+from flask import Flask, request, jsonify, Response
 
 # ========================================
 # EVENT MONITOR SERVICE
@@ -21,33 +25,137 @@ logging.basicConfig(
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
+# SSE memory bounds: frames buffered per client, and bytes of replay history
+SUBSCRIBER_BUFFER = int(os.getenv("SUBSCRIBER_BUFFER", "20"))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(1 << 20)))
+# Frames arriving within this window go out to a client as one write
+SSE_COALESCE_MS = int(os.getenv("SSE_COALESCE_MS", "20"))
+
+# SSE framing bytes around each JSON payload
+EVT_PREFIX = b"event: monitor_event\ndata: "
+SSE_SUFFIX = b"\n\n"
+
+
+class RingSubscriber:
+    """
+    Bounded buffer feeding one SSE client
+    
+    A deque(maxlen) evicts the oldest frame when a slow client falls
+    behind, so the client stays connected and memory stays capped.
+    A Condition wakes the consumer when a frame arrives; the stream ends
+    only when the client disconnects.
+    """
+    __slots__ = ('buf', 'cond')
+    
+    def __init__(self, size):
+        self.buf = collections.deque(maxlen=size)
+        self.cond = threading.Condition()
+    
+    def push(self, msg):
+        """Queue a frame; when full the oldest buffered frame is dropped"""
+        with self.cond:
+            self.buf.append(msg)
+            self.cond.notify()
+    
+    def messages(self):
+        """Yield buffered frames, coalesced per wakeup"""
+        while True:
+            with self.cond:
+                while not self.buf:
+                    self.cond.wait()
+            # Let a burst accumulate so it is flushed in a single write
+            if SSE_COALESCE_MS:
+                time.sleep(SSE_COALESCE_MS / 1000)
+            with self.cond:
+                frames = list(self.buf)
+                self.buf.clear()
+            # Yield outside the lock so a slow socket never blocks producers
+            yield frames[0] if len(frames) == 1 else b"".join(frames)
+
+
+class ByteRing:
+    """
+    Replay history stored in one fixed-size bytearray
+    
+    Frames are copied into a circular buffer and indexed by (offset, length).
+    The oldest frames are evicted until a new one fits, so memory stays at
+    `cap` bytes whatever the mix of message sizes.
+    """
+    __slots__ = ('buf', 'cap', 'head', 'used', 'frames')
+    
+    def __init__(self, cap):
+        self.buf = bytearray(cap)
+        self.cap = cap
+        self.head = 0
+        self.used = 0
+        self.frames = collections.deque()
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def append(self, frame):
+        """Copy a frame in, evicting the oldest frames to make room"""
+        size = len(frame)
+        if size > self.cap:
+            return  # Larger than the whole ring: live clients only
+        while self.used + size > self.cap:
+            self.used -= self.frames.popleft()[1]
+        
+        # Write contiguously, wrapping to the start of the buffer if needed
+        view = memoryview(frame)
+        start = self.head
+        first = min(size, self.cap - start)
+        self.buf[start:start + first] = view[:first]
+        if first < size:
+            self.buf[:size - first] = view[first:]
+        
+        self.frames.append((start, size))
+        self.head = (start + size) % self.cap
+        self.used += size
+    
+    def snapshot(self):
+        """Copy out every stored frame, oldest first"""
+        view = memoryview(self.buf)
+        out = []
+        for start, size in self.frames:
+            end = start + size
+            if end <= self.cap:
+                out.append(bytes(view[start:end]))
+            else:
+                out.append(bytes(view[start:]) + bytes(view[:end - self.cap]))
+        return out
+
 
 class EventAnnouncer:
     """Manages SSE for real-time event monitoring"""
     
     def __init__(self):
-        self.listeners = []
-        self.history = collections.deque(maxlen=200)
+        self.listeners = {}  # token -> RingSubscriber, O(1) removal on disconnect
+        self._tokens = itertools.count()
+        self.history = ByteRing(HISTORY_MAX_BYTES)
+        self._lock = threading.Lock()  # serializes producers and history reads
     
     def listen(self):
-        for msg in list(self.history):
-            yield msg
-        q = queue.Queue(maxsize=20)
-        self.listeners.append(q)
+        sub = RingSubscriber(SUBSCRIBER_BUFFER)
+        token = next(self._tokens)
+        # Snapshot and subscribe together so no frame is missed or repeated
+        with self._lock:
+            replay = self.history.snapshot()
+            self.listeners[token] = sub
         try:
-            while True:
-                msg = q.get()
-                yield msg
+            # Replay the whole history as one write rather than one per frame
+            if replay:
+                yield b"".join(replay)
+            yield from sub.messages()
         finally:
-            self.listeners.remove(q)
+            with self._lock:
+                self.listeners.pop(token, None)
     
     def announce(self, msg):
-        self.history.append(msg)
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except queue.Full:
-                del self.listeners[i]
+        with self._lock:
+            self.history.append(msg)
+            for sub in list(self.listeners.values()):
+                sub.push(msg)
 
 
 announcer = EventAnnouncer()
@@ -164,11 +272,72 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# The template has no variables: encode it once and let browsers revalidate by ETag
+_INDEX_BODY = HTML_TEMPLATE.encode('utf-8')
+_INDEX_ETAG = hashlib.md5(_INDEX_BODY).hexdigest()
+_INDEX_HEADERS = {
+    'ETag': f'"{_INDEX_ETAG}"',
+    'Cache-Control': 'public, max-age=60',
+    'Vary': 'Accept-Encoding'
+}
+
+# Gzipped variant, compressed once at import (mtime=0 keeps it reproducible)
+_INDEX_GZ_BODY = gzip.compress(_INDEX_BODY, 9, mtime=0)
+_INDEX_GZ_ETAG = _INDEX_ETAG + '-gz'
+_INDEX_GZ_HEADERS = {
+    'ETag': f'"{_INDEX_GZ_ETAG}"',
+    'Cache-Control': 'public, max-age=60',
+    'Vary': 'Accept-Encoding',
+    'Content-Encoding': 'gzip'
+}
+
+
+# Stage classification: CloudEvent types look like
+# com.learning.message.<stage>[.<route>], so the <stage> segment
+# resolves with a single dict lookup
+_STAGE_BY_SEGMENT = {
+    "received": "received",
+    "extracted": "extracted",
+    "validated": "validated",
+    "validation-failed": "validated",
+    "enriched": "enriched",
+    "enrichment-failed": "failed",
+    "routed": "routed",
+}
+
+# Substring fallback for any other type, in precedence order
+_STAGE_RULES = (
+    ("received", "received"),
+    ("extracted", "extracted"),
+    ("validated", "validated"),
+    ("validation", "validated"),
+    ("enriched", "enriched"),
+    ("routed", "routed"),
+    ("failed", "failed"),
+    ("error", "failed"),
+)
+
+
+def classify_stage(event_type):
+    """Map a CloudEvent type to its processing stage"""
+    parts = event_type.split('.', 4)
+    if len(parts) > 3:
+        stage = _STAGE_BY_SEGMENT.get(parts[3])
+        if stage:
+            return stage
+    return next((stage for token, stage in _STAGE_RULES if token in event_type), "unknown")
+
 
 @app.route('/')
 def index():
     """Serve the event monitor dashboard"""
-    return render_template_string(HTML_TEMPLATE)
+    if request.accept_encodings['gzip']:
+        body, etag, headers = _INDEX_GZ_BODY, _INDEX_GZ_ETAG, _INDEX_GZ_HEADERS
+    else:
+        body, etag, headers = _INDEX_BODY, _INDEX_ETAG, _INDEX_HEADERS
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='text/html', headers=headers)
 
 
 @app.route('/healthz', methods=['GET'])
@@ -195,34 +364,28 @@ def handle_event():
     4. Event flow visualization
     """
     try:
-        # Extract CloudEvent metadata from headers
+        payload = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON body"}), 400
+    
+    try:
+        # Extract CloudEvent metadata straight from the WSGI environ
+        # (plain dict lookups instead of case-insensitive header scans)
+        env = request.environ
         cloud_event = {
-            "type": request.headers.get('Ce-Type', 'unknown'),
-            "source": request.headers.get('Ce-Source', 'unknown'),
-            "id": request.headers.get('Ce-Id', 'unknown'),
-            "specversion": request.headers.get('Ce-Specversion', '1.0'),
-            "subject": request.headers.get('Ce-Subject', 'unknown'),
-            "payload": request.get_json()
+            "type": env.get('HTTP_CE_TYPE', 'unknown'),
+            "source": env.get('HTTP_CE_SOURCE', 'unknown'),
+            "id": env.get('HTTP_CE_ID', 'unknown'),
+            "specversion": env.get('HTTP_CE_SPECVERSION', '1.0'),
+            "subject": env.get('HTTP_CE_SUBJECT', 'unknown'),
+            "payload": payload
         }
         
         message_id = cloud_event["subject"]
         
         # Determine processing stage from event type
         event_type = cloud_event["type"]
-        if "received" in event_type:
-            stage = "received"
-        elif "extracted" in event_type:
-            stage = "extracted"
-        elif "validated" in event_type or "validation" in event_type:
-            stage = "validated"
-        elif "enriched" in event_type:
-            stage = "enriched"
-        elif "routed" in event_type:
-            stage = "routed"
-        elif "failed" in event_type or "error" in event_type:
-            stage = "failed"
-        else:
-            stage = "unknown"
+        stage = classify_stage(event_type)
         
         logging.info(f"[{message_id}] 📊 Event captured: {event_type} (stage: {stage})")
         
@@ -233,10 +396,11 @@ def handle_event():
             "stage": stage
         }
         
-        sse_msg = f"event: monitor_event\ndata: {json.dumps(sse_data)}\n\n"
+        # Serialize once to bytes - every subscriber and the history share this frame
+        sse_frame = EVT_PREFIX + orjson.dumps(sse_data) + SSE_SUFFIX
         
         # Announce to all connected clients
-        announcer.announce(sse_msg)
+        announcer.announce(sse_frame)
         
         logging.debug(f"[{message_id}] Broadcasted to {len(announcer.listeners)} monitors")
         
@@ -251,4 +415,6 @@ def handle_event():
 if __name__ == '__main__':
     logging.info(f"Event Monitor starting on port {APP_PORT}")
     logging.info("Access the dashboard at http://localhost:8080")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True, threaded=True)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1', threaded=True)
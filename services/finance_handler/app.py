@@ -1,9 +1,13 @@
 import os
-import json
+import gzip
+import time
 import logging
-import queue
+import hashlib
+import itertools
+import threading
 import collections
-from flask import Flask, request, jsonify, render_template_string, Response
+import orjson
+from flask import Flask, request, jsonify, Response
 
 # ========================================
 # FINANCE HANDLER SERVICE
@@ -21,6 +25,53 @@ logging.basicConfig(
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
+# SSE memory bounds: frames buffered per client, and bytes of replay history
+SUBSCRIBER_BUFFER = int(os.getenv("SUBSCRIBER_BUFFER", "20"))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(1 << 20)))
+# Frames arriving within this window go out to a client as one write
+SSE_COALESCE_MS = int(os.getenv("SSE_COALESCE_MS", "20"))
+
+# SSE framing bytes around each JSON payload
+FIN_PREFIX = b"event: finance_message\ndata: "
+SSE_SUFFIX = b"\n\n"
+
+
+class RingSubscriber:
+    """
+    Bounded buffer feeding one SSE client
+    
+    A deque(maxlen) evicts the oldest frame when a slow client falls
+    behind, so the client stays connected and memory stays capped.
+    A Condition wakes the consumer when a frame arrives; the stream ends
+    only when the client disconnects.
+    """
+    __slots__ = ('buf', 'cond')
+    
+    def __init__(self, size):
+        self.buf = collections.deque(maxlen=size)
+        self.cond = threading.Condition()
+    
+    def push(self, msg):
+        """Queue a frame; when full the oldest buffered frame is dropped"""
+        with self.cond:
+            self.buf.append(msg)
+            self.cond.notify()
+    
+    def messages(self):
+        """Yield buffered frames, coalesced per wakeup"""
+        while True:
+            with self.cond:
+                while not self.buf:
+                    self.cond.wait()
+            # Let a burst accumulate so it is flushed in a single write
+            if SSE_COALESCE_MS:
+                time.sleep(SSE_COALESCE_MS / 1000)
+            with self.cond:
+                frames = list(self.buf)
+                self.buf.clear()
+            # Yield outside the lock so a slow socket never blocks producers
+            yield frames[0] if len(frames) == 1 else b"".join(frames)
+
 
 class MessageAnnouncer:
     """
@@ -34,33 +85,39 @@ class MessageAnnouncer:
     """
     
     def __init__(self):
-        self.listeners = []
-        self.history = collections.deque(maxlen=100)  # Keep last 100 messages
+        self.listeners = {}  # token -> RingSubscriber, O(1) removal on disconnect
+        self._tokens = itertools.count()
+        self.history = collections.deque()  # capped by HISTORY_MAX_BYTES
+        self.history_bytes = 0
+        self._lock = threading.Lock()  # serializes producers and history reads
     
     def listen(self):
         """Generator for SSE stream - sends history then new messages"""
-        # Send history first
-        for msg in list(self.history):
-            yield msg
-        
-        # Then listen for new messages
-        q = queue.Queue(maxsize=10)
-        self.listeners.append(q)
+        sub = RingSubscriber(SUBSCRIBER_BUFFER)
+        token = next(self._tokens)
+        # Snapshot and subscribe together so no frame is missed or repeated
+        # (deque.copy() is a single C-level snapshot)
+        with self._lock:
+            snapshot = self.history.copy()
+            self.listeners[token] = sub
         try:
-            while True:
-                msg = q.get()
-                yield msg
+            # Send history first as a single write, then listen for new messages
+            if snapshot:
+                yield b"".join(snapshot)
+            yield from sub.messages()
         finally:
-            self.listeners.remove(q)
+            with self._lock:
+                self.listeners.pop(token, None)
     
     def announce(self, msg):
         """Send message to all connected clients"""
-        self.history.append(msg)
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except queue.Full:
-                del self.listeners[i]
+        with self._lock:
+            self.history.append(msg)
+            self.history_bytes += len(msg)
+            while self.history_bytes > HISTORY_MAX_BYTES and len(self.history) > 1:
+                self.history_bytes -= len(self.history.popleft())
+            for sub in list(self.listeners.values()):
+                sub.push(msg)
 
 
 announcer = MessageAnnouncer()
@@ -174,11 +231,36 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# The template has no variables: encode it once and let browsers revalidate by ETag
+_INDEX_BODY = HTML_TEMPLATE.encode('utf-8')
+_INDEX_ETAG = hashlib.md5(_INDEX_BODY).hexdigest()
+_INDEX_HEADERS = {
+    'ETag': f'"{_INDEX_ETAG}"',
+    'Cache-Control': 'public, max-age=60',
+    'Vary': 'Accept-Encoding'
+}
+
+# Gzipped variant, compressed once at import (mtime=0 keeps it reproducible)
+_INDEX_GZ_BODY = gzip.compress(_INDEX_BODY, 9, mtime=0)
+_INDEX_GZ_ETAG = _INDEX_ETAG + '-gz'
+_INDEX_GZ_HEADERS = {
+    'ETag': f'"{_INDEX_GZ_ETAG}"',
+    'Cache-Control': 'public, max-age=60',
+    'Vary': 'Accept-Encoding',
+    'Content-Encoding': 'gzip'
+}
+
 
 @app.route('/')
 def index():
     """Serve the finance inbox UI"""
-    return render_template_string(HTML_TEMPLATE)
+    if request.accept_encodings['gzip']:
+        body, etag, headers = _INDEX_GZ_BODY, _INDEX_GZ_ETAG, _INDEX_GZ_HEADERS
+    else:
+        body, etag, headers = _INDEX_BODY, _INDEX_ETAG, _INDEX_HEADERS
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='text/html', headers=headers)
 
 
 @app.route('/healthz', methods=['GET'])
@@ -208,17 +290,24 @@ def handle_event():
         return jsonify({"error": "Must be JSON"}), 415
 
     try:
-        event_type = request.headers.get('Ce-Type', 'unknown')
-        message_id = request.headers.get('Ce-Subject', 'unknown')
-        payload = request.get_json()
+        payload = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON body"}), 400
+
+    try:
+        # Read CloudEvent headers straight from the WSGI environ
+        env = request.environ
+        event_type = env.get('HTTP_CE_TYPE', 'unknown')
+        message_id = env.get('HTTP_CE_SUBJECT', 'unknown')
         
         logging.info(f"[{message_id}] 📥 Finance message received (type: {event_type})")
         
         # Format for SSE
-        sse_msg = f"event: finance_message\ndata: {json.dumps(payload)}\n\n"
+        # Serialize once to bytes - every subscriber and the history share this frame
+        sse_frame = FIN_PREFIX + orjson.dumps(payload) + SSE_SUFFIX
         
         # Announce to all connected clients
-        announcer.announce(sse_msg)
+        announcer.announce(sse_frame)
         
         logging.info(f"[{message_id}] ✅ Message delivered to {len(announcer.listeners)} connected clients")
         
@@ -233,4 +322,6 @@ def handle_event():
 if __name__ == '__main__':
     logging.info(f"Finance Handler UI starting on port {APP_PORT}")
     logging.info("Access the inbox at http://localhost:8080")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True, threaded=True)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1', threaded=True)
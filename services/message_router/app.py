@@ -1,6 +1,7 @@
 import os
-import uuid
 import logging
+import orjson
+import ahocorasick
 from flask import Flask, request, jsonify
 
 # ========================================
@@ -20,6 +21,26 @@ logging.basicConfig(
 APP_PORT = int(os.getenv("PORT", "8080"))
 
 
+def fast_uuid():
+    """Random (version 4) UUID string built straight from os.urandom"""
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40  # version 4
+    b[8] = (b[8] & 0x3F) | 0x80  # RFC 4122 variant
+    h = b.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _is_word_char(ch):
+    """Same notion of a word character as regex \\w"""
+    return ch.isalnum() or ch == '_'
+
+
+def _is_whole_word(text, start, end):
+    """True when text[start:end + 1] is not embedded in a longer word"""
+    return ((start == 0 or not _is_word_char(text[start - 1])) and
+            (end + 1 == len(text) or not _is_word_char(text[end + 1])))
+
+
 class MessageRouter:
     """
     Routes messages to appropriate departments using keyword matching
@@ -61,18 +82,44 @@ class MessageRouter:
                 'weight': 1.0
             }
         }
+        
+        # Single Aho-Corasick automaton over every keyword (one pass per message)
+        categories_by_keyword = {}
+        for category, config in self.routing_rules.items():
+            for keyword in config['keywords']:
+                categories_by_keyword.setdefault(keyword, []).append(category)
+        
+        self.automaton = ahocorasick.Automaton()
+        for keyword, categories in categories_by_keyword.items():
+            self.automaton.add_word(keyword, (keyword, tuple(categories)))
+        self.automaton.make_automaton()
     
     def calculate_route_scores(self, text):
         """Calculate confidence scores for each route"""
+        # Distinct whole-word keywords found, tallied per category
+        # ("cost" must not match inside "costume")
         text_lower = text.lower()
+        hits = {
+            hit for end, hit in self.automaton.iter(text_lower)
+            if _is_whole_word(text_lower, end - len(hit[0]) + 1, end)
+        }
+        if not hits:
+            # Nothing matched the automaton: skip the per-category walk
+            return {
+                category: {'score': 0.0, 'matches': 0}
+                for category in self.routing_rules
+            }
+        
+        match_counts = dict.fromkeys(self.routing_rules, 0)
+        for _, categories in hits:
+            for category in categories:
+                match_counts[category] += 1
+        
         scores = {}
         
         for category, config in self.routing_rules.items():
-            keywords = config['keywords']
             weight = config['weight']
-            
-            # Count keyword matches
-            matches = sum(1 for keyword in keywords if keyword in text_lower)
+            matches = match_counts[category]
             
             # Calculate weighted score
             score = matches * weight
@@ -156,7 +203,7 @@ def handle_event():
         return jsonify({"error": "Must be JSON"}), 415
 
     try:
-        incoming_payload = request.get_json()
+        incoming_payload = orjson.loads(request.get_data(cache=False))
         message_id = incoming_payload.get("message_id", "unknown")
         
         logging.info(f"[{message_id}] 📥 Received event from Broker")
@@ -187,7 +234,7 @@ def handle_event():
         "Ce-Specversion": "1.0",
         "Ce-Type": event_type,
         "Ce-Source": "/services/message-router",
-        "Ce-Id": str(uuid.uuid4()),
+        "Ce-Id": fast_uuid(),
         "Ce-Subject": message_id,
     }
 
@@ -197,4 +244,6 @@ def handle_event():
 
 if __name__ == '__main__':
     logging.info(f"Service starting on port {APP_PORT}")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -1,7 +1,13 @@
 import os
-import json
+import queue
+import atexit
 import logging
-from flask import Flask, request, jsonify
+import itertools
+import collections
+from time import perf_counter_ns
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+from flask import Flask, request, Response
 
 # ========================================
 # SUPPORT HANDLER SERVICE
@@ -12,30 +18,141 @@ from flask import Flask, request, jsonify
 # ========================================
 
 app = Flask(__name__)
+
+# Request threads only enqueue log records; a background listener thread
+# formats them and does the stderr write
+_log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter(
+    '%(asctime)s - [SUPPORT_HANDLER] - %(levelname)s - %(message)s'
+))
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - [SUPPORT_HANDLER] - %(levelname)s - %(message)s'
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(message)s',  # only merges args; the listener applies the full format
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener = QueueListener(_log_queue, _log_output, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # flush queued records on shutdown
+logger = logging.getLogger(__name__)
 
 APP_PORT = int(os.getenv("PORT", "8080"))
 
-# In-memory storage for demo
-support_messages = []
+# In-memory storage for demo (bounded: oldest messages are evicted)
+MSG_BUFFER = int(os.getenv("MSG_BUFFER", "1024"))
+RECENT_MESSAGES = 50
+# Rows are (event_type, message_id, payload, received_at) tuples - far smaller
+# than a dict per message; dicts are only built for the /messages reply
+MESSAGE_FIELDS = ("event_type", "message_id", "payload", "received_at")
+support_messages = collections.deque(maxlen=MSG_BUFFER)
+
+# Largest event body accepted before parsing (bytes)
+MAX_BODY = int(os.getenv("MAX_BODY", "65536"))
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY  # also caps chunked bodies while reading
+
+# Optional restart durability: point MSG_SNAPSHOT_PATH at a mounted volume
+# (e.g. an emptyDir) and recent messages are dumped there on shutdown and
+# reloaded on start
+MSG_SNAPSHOT_PATH = os.getenv("MSG_SNAPSHOT_PATH")
+
+# Recent handler timings (total ns, logging ns) behind /stats
+STATS_WINDOW = int(os.getenv("STATS_WINDOW", "1024"))
+handler_timings = collections.deque(maxlen=STATS_WINDOW)
+
+
+def _json_bytes_response(body, status=200):
+    """Wrap already-serialized JSON bytes in a response"""
+    return Response(body, status=status, mimetype="application/json")
+
+
+def _json_response(obj, status=200):
+    """Serialize with orjson straight to a JSON response"""
+    return _json_bytes_response(orjson.dumps(obj), status)
+
+
+# Constant replies, serialized once at import
+_OK_BYTES = b"OK"
+_NOT_JSON = orjson.dumps({"error": "Must be JSON"})
+_TOO_LARGE = orjson.dumps({"error": "Payload too large"})
+_BAD_JSON = orjson.dumps({"error": "Invalid JSON body"})
+_NOT_OBJECT = orjson.dumps({"error": "Event payload must be a JSON object"})
+
+# Hot-path aliases: one global lookup per call instead of global + attribute
+_loads = orjson.loads
+_store_message = support_messages.append
+_record_timing = handler_timings.append
+_log_enabled = logger.isEnabledFor
+_log_info = logger.info
+_log_warning = logger.warning
+_INFO = logging.INFO
+
+
+# Shared stand-in for a missing section - read-only, never mutate it
+_EMPTY = {}
+
+
+def _extract(payload):
+    """
+    Pull every field the handler reads from a routed event in one pass
+    
+    Returns (customer_name, sentiment, is_urgent,
+             is_known_customer, first_name, last_name)
+    """
+    extracted = payload.get("extracted_data")
+    if not isinstance(extracted, dict):
+        extracted = _EMPTY
+    customer = payload.get("customer_data")
+    if not isinstance(customer, dict):
+        customer = _EMPTY
+    return (
+        extracted.get("customer_name", "Unknown"),
+        extracted.get("sentiment", "neutral"),
+        extracted.get("is_urgent"),
+        customer.get("is_known_customer"),
+        customer.get("first_name"),
+        customer.get("last_name"),
+    )
 
 
 @app.route('/healthz', methods=['GET'])
 def healthz():
     """Kubernetes health check"""
-    return "OK", 200
+    return _OK_BYTES, 200
 
 
 @app.route('/messages', methods=['GET'])
 def get_messages():
     """API endpoint to retrieve support messages"""
-    return jsonify({
+    return _json_response({
         "total": len(support_messages),
-        "messages": support_messages[-50:]  # Last 50 messages
-    }), 200
+        # Last 50 messages, read from the tail without copying the buffer
+        "messages": [
+            dict(zip(MESSAGE_FIELDS, row))
+            for row in list(itertools.islice(reversed(support_messages), RECENT_MESSAGES))[::-1]
+        ]
+    })
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """How much of the handler's wall time goes to logging"""
+    samples = list(handler_timings)
+    if not samples:
+        return _json_response({"samples": 0})
+    
+    total = sorted(t for t, _ in samples)
+    logging_ns = sorted(l for _, l in samples)
+    return _json_response({
+        "samples": len(samples),
+        "handler_ns": {"p50": _percentile(total, 0.5), "p99": _percentile(total, 0.99)},
+        "logging_ns": {"p50": _percentile(logging_ns, 0.5), "p99": _percentile(logging_ns, 0.99)},
+        "logging_share": sum(logging_ns) / max(sum(total), 1)
+    })
 
 
 @app.route('/', methods=['POST'])
@@ -49,44 +166,102 @@ def handle_event():
     3. In-memory storage
     4. REST API for message retrieval
     """
+    t0 = perf_counter_ns()
     if not request.is_json:
-        return jsonify({"error": "Must be JSON"}), 415
+        return _json_bytes_response(_NOT_JSON, 415)
+
+    # Reject oversized bodies before reading them into memory
+    if (request.content_length or 0) > MAX_BODY:
+        return _json_bytes_response(_TOO_LARGE, 413)
 
     try:
-        event_type = request.headers.get('Ce-Type', 'unknown')
-        message_id = request.headers.get('Ce-Subject', 'unknown')
-        payload = request.get_json()
-        
-        logging.info(f"[{message_id}] 📥 Support message received (type: {event_type})")
-        
-        # Store message
-        support_messages.append({
-            "event_type": event_type,
-            "message_id": message_id,
-            "payload": payload,
-            "received_at": payload.get("timestamp")
-        })
-        
-        # Log important details
-        extracted = payload.get("extracted_data", {})
-        customer = payload.get("customer_data", {})
-        
-        logging.info(f"[{message_id}] 📧 From: {extracted.get('customer_name', 'Unknown')}")
-        logging.info(f"[{message_id}] 📊 Sentiment: {extracted.get('sentiment', 'neutral')}")
-        if extracted.get('is_urgent'):
-            logging.warning(f"[{message_id}] ⚠️  URGENT support request!")
-        
-        if customer.get('is_known_customer'):
-            logging.info(f"[{message_id}] 👤 Known customer: {customer.get('first_name')} {customer.get('last_name')}")
-        
-        # Acknowledge receipt
-        return jsonify({"status": "received", "queue_position": len(support_messages)}), 200
-
-    except Exception as e:
-        logging.error(f"Error handling event: {e}")
-        return jsonify({"error": str(e)}), 500
+        payload = _loads(request.get_data(cache=False, parse_form_data=False))
+    except orjson.JSONDecodeError:
+        return _json_bytes_response(_BAD_JSON, 400)
+
+    # Only JSON objects are valid events
+    if not isinstance(payload, dict):
+        return _json_bytes_response(_NOT_OBJECT, 400)
+
+    # Read CloudEvent headers straight from the WSGI environ
+    env = request.environ
+    event_type = env.get('HTTP_CE_TYPE', 'unknown')
+    message_id = env.get('HTTP_CE_SUBJECT', 'unknown')
+    
+    # Store message
+    _store_message((event_type, message_id, payload, payload.get("timestamp")))
+    
+    # One summary record per message (skip formatting entirely when INFO is off)
+    name, sentiment, is_urgent, is_known, first_name, last_name = _extract(payload)
+    tl = perf_counter_ns()
+    if _log_enabled(_INFO):
+        _log_info(
+            "[%s] 📥 Support message received (type: %s, from: %s, sentiment: %s, known customer: %s)",
+            message_id, event_type, name, sentiment,
+            f"{first_name} {last_name}" if is_known else "no"
+        )
+    
+    if is_urgent:
+        _log_warning("[%s] ⚠️  URGENT support request!", message_id)
+    log_ns = perf_counter_ns() - tl
+    
+    _record_timing((perf_counter_ns() - t0, log_ns))
+    
+    # Acknowledge receipt
+    return _json_response({"status": "received", "queue_position": len(support_messages)})
+
+
+def _load_snapshot(path):
+    """Refill the message buffer from a previous run's snapshot"""
+    try:
+        with open(path, 'rb') as f:
+            rows = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    except (OSError, orjson.JSONDecodeError) as e:
+        logger.warning("⚠️  Ignoring unreadable message snapshot %s: %s", path, e)
+        return
+    # Well-formed JSON of the wrong shape must not break startup
+    if not (isinstance(rows, list) and
+            all(isinstance(row, list) and len(row) == len(MESSAGE_FIELDS) for row in rows)):
+        logger.warning("⚠️  Ignoring malformed message snapshot %s", path)
+        return
+    support_messages.extend(tuple(row) for row in rows)
+    logger.info("✅ Restored %s support messages from %s", len(support_messages), path)
+
+
+def _dump_snapshot(path):
+    """Write the buffer atomically (temp file + rename) at interpreter exit"""
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(orjson.dumps(list(support_messages)))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("⚠️  Could not write message snapshot %s: %s", path, e)
+
+
+if MSG_SNAPSHOT_PATH:
+    _load_snapshot(MSG_SNAPSHOT_PATH)
+    # Runs on gunicorn's graceful worker exit (SIGTERM) and on Ctrl-C
+    atexit.register(_dump_snapshot, MSG_SNAPSHOT_PATH)
+
+
+def _healthz_fast_path(wsgi_app):
+    """Answer liveness probes before Flask routing and request context setup"""
+    def middleware(environ, start_response):
+        if environ.get('PATH_INFO') == '/healthz' and environ.get('REQUEST_METHOD') == 'GET':
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+            return [_OK_BYTES]
+        return wsgi_app(environ, start_response)
+    return middleware
+
+
+app.wsgi_app = _healthz_fast_path(app.wsgi_app)
 
 
 if __name__ == '__main__':
-    logging.info(f"Support Handler starting on port {APP_PORT}")
-    app.run(host='0.0.0.0', port=APP_PORT, debug=True)
+    logger.info("Support Handler starting on port %s", APP_PORT)
+    # Quiet per-request access logging; FLASK_DEBUG=1 opts into the debugger/reloader
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host='0.0.0.0', port=APP_PORT, debug=os.getenv('FLASK_DEBUG') == '1')